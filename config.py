@@ -27,9 +27,14 @@ FILE_PATHS = {
     'subject_file': 'bangumiArchive/subject.jsonlines'
 }
 
+# 提交消息中的数据日期，如 dump-2025-01-01.210310Z.zip
+_DUMP_RE = re.compile(r'dump-(\d{4}-\d{2}-\d{2})\.')
+
 BATCH_CONFIG = {
     'batch_size': 1000,
-    'commit_interval': 100
+    'commit_interval': 100,
+    # 大批量回填时设为True：导入前删除二级索引，导入后重建
+    'rebuild_indexes': os.getenv('REBUILD_INDEXES', '').lower() in ('1', 'true', 'yes')
 }
 
 def _get_commit_message_dump_date() -> Optional[str]:
@@ -42,7 +47,7 @@ def _get_commit_message_dump_date() -> Optional[str]:
             stderr=subprocess.STDOUT,
             universal_newlines=True
         )
-        m = re.search(r'dump-(\d{4}-\d{2}-\d{2})\.', msg)
+        m = _DUMP_RE.search(msg)
         if m:
             return m.group(1)
         return None
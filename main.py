@@ -9,18 +9,27 @@
 import sys
 import subprocess
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Any, Dict, Optional, List, Tuple
 
 import config as cfg
 
 from config import DATABASE_CONFIG, FILE_PATHS, DATA_CONFIG
-from processors import ProcessorFactory
+from processors import BaseDataProcessor, ProcessorFactory
 from utils import setup_logger
 
 # 配置日志
 logger = setup_logger(__name__)
 
+# 项目目录、数据仓库目录及数据文件路径（模块加载时计算一次）
+_BASE_DIR = Path(__file__).parent
+_REPO_DIR = _BASE_DIR / 'bangumiArchive'
+_FILE_PATHS = {key: _BASE_DIR / path for key, path in FILE_PATHS.items()}
+
+# 提交消息中的数据日期，如 dump-2025-01-01.210310Z.zip
+_DUMP_RE = re.compile(r'dump-(\d{4}-\d{2}-\d{2})\.')
+
 
 def parse_arguments() -> tuple:
     """解析命令行参数
@@ -73,15 +82,13 @@ def get_file_path(data_type: str) -> Optional[Path]:
     Returns:
         Optional[Path]: 文件路径，如果不存在则返回None
     """
-    base_dir = Path(__file__).parent
     file_key = f"{data_type}_file"
+    file_path = _FILE_PATHS.get(file_key)
     
-    if file_key not in FILE_PATHS:
+    if file_path is None:
         logger.error(f"配置中未找到 {file_key} 路径")
         return None
     
-    file_path = base_dir / FILE_PATHS[file_key]
-    
     if not file_path.exists():
         logger.warning(f"{data_type} 文件不存在: {file_path}")
         return None
@@ -89,21 +96,56 @@ def get_file_path(data_type: str) -> Optional[Path]:
     return file_path
 
 
-def process_data_type(data_type: str, limit: Optional[int] = None) -> bool:
+def _load_data_file(processor: BaseDataProcessor, data_type: str,
+                    limit: Optional[int] = None) -> bool:
+    """使用已就绪的处理器导入指定类型的数据文件
+    
+    Args:
+        processor: 已连接且已建表的处理器
+        data_type: 数据类型
+        limit: 限制处理的记录数
+        
+    Returns:
+        bool: 处理是否成功
+    """
+    # 获取文件路径
+    file_path = get_file_path(data_type)
+    if not file_path:
+        return False
+    
+    # 处理文件
+    processor.process_file(str(file_path), limit)
+    
+    logger.info(f"{data_type} 数据处理完成！")
+    return True
+
+
+def process_data_type(data_type: str, limit: Optional[int] = None,
+                      processor: Optional[BaseDataProcessor] = None,
+                      show_progress: bool = True) -> bool:
     """处理指定类型的数据
     
     Args:
         data_type: 数据类型
         limit: 限制处理的记录数
+        processor: 已连接且已建表的处理器，提供时复用其连接，由调用方负责提交和关闭
         
     Returns:
         bool: 处理是否成功
     """
     logger.info(f"\n=== 开始处理 {data_type} 数据 ===")
     
+    if processor is not None:
+        try:
+            return _load_data_file(processor, data_type, limit)
+        except Exception as e:
+            logger.error(f"处理 {data_type} 数据失败: {e}")
+            return False
+    
     try:
         # 创建处理器
         processor = ProcessorFactory.create_processor(data_type, DATABASE_CONFIG)
+        processor.show_progress = show_progress
         
         # 连接数据库
         if not processor.connect_db():
@@ -114,16 +156,15 @@ def process_data_type(data_type: str, limit: Optional[int] = None) -> bool:
             # 创建表
             processor.create_tables()
             
-            # 获取文件路径
-            file_path = get_file_path(data_type)
-            if not file_path:
-                return False
+            if not processor.rebuild_indexes:
+                return _load_data_file(processor, data_type, limit)
             
-            # 处理文件
-            processor.process_file(str(file_path), limit)
-            
-            logger.info(f"{data_type} 数据处理完成！")
-            return True
+            # 导入前删除二级索引，导入完成后重建
+            processor.drop_indexes()
+            try:
+                return _load_data_file(processor, data_type, limit)
+            finally:
+                processor.create_indexes_post_load()
             
         except Exception as e:
             logger.error(f"处理 {data_type} 数据失败: {e}")
@@ -137,14 +178,49 @@ def process_data_type(data_type: str, limit: Optional[int] = None) -> bool:
         return False
 
 
-def _repo_dir() -> Path:
-    return Path(__file__).parent / 'bangumiArchive'
+def _process_data_type_worker(args: Tuple[str, Optional[int], str]) -> bool:
+    """子进程入口：在独立进程中处理一种数据类型
+    
+    每个子进程各自建立数据库连接（psycopg2连接不能跨进程共享），
+    并显式设置数据日期，避免spawn方式启动时丢失父进程中修改过的配置。
+    多个子进程共用同一终端，因此不显示进度条，仅通过日志报告各类型的完成情况。
+    
+    Args:
+        args: (data_type, limit, data_date)
+        
+    Returns:
+        bool: 处理是否成功
+    """
+    data_type, limit, data_date = args
+    cfg.DATA_CONFIG['data_date'] = data_date
+    return process_data_type(data_type, limit, show_progress=False)
+
+
+def process_data_types(data_types: List[str], limit: Optional[int] = None) -> int:
+    """并行处理多种数据类型
+    
+    各数据类型写入互不相交的表，使用多进程并行处理以同时利用磁盘读取和数据库写入。
+    
+    Args:
+        data_types: 数据类型列表
+        limit: 限制处理的记录数
+        
+    Returns:
+        int: 处理成功的数据类型数量
+    """
+    if len(data_types) == 1:
+        return int(process_data_type(data_types[0], limit))
+    
+    tasks = [(t, limit, cfg.DATA_CONFIG['data_date']) for t in data_types]
+    with ProcessPoolExecutor(max_workers=min(3, len(data_types))) as executor:
+        results = list(executor.map(_process_data_type_worker, tasks))
+    return sum(results)
 
 
 def _list_dump_commits() -> List[Tuple[str, str, str]]:
     try:
         out = subprocess.check_output(
-            ['git', '-C', str(_repo_dir()), 'log', '--reverse', '--pretty=%H %s', 'master'],
+            ['git', '-C', str(_REPO_DIR), 'log', '--reverse', '--pretty=%H %s', 'master'],
             stderr=subprocess.STDOUT,
             universal_newlines=True
         )
@@ -157,16 +233,17 @@ def _list_dump_commits() -> List[Tuple[str, str, str]]:
         parts = line.split(' ', 1)
         h = parts[0]
         s = parts[1] if len(parts) > 1 else ''
-        m = re.search(r'dump-(\d{4}-\d{2}-\d{2})\.', s)
+        if 'dump-' not in s:
+            continue
+        m = _DUMP_RE.search(s)
         if m:
             commits.append((h, m.group(1), s))
     return commits
 
 
 def _remove_jsonlines():
-    base_dir = Path(__file__).parent
     for key in ('character_file', 'person_file', 'subject_file'):
-        p = base_dir / FILE_PATHS[key]
+        p = _FILE_PATHS[key]
         try:
             if p.exists():
                 p.unlink()
@@ -174,21 +251,194 @@ def _remove_jsonlines():
             pass
 
 
-def _checkout_commit(h: str) -> bool:
+def _copy_exact(src, dst, size: int, chunk_size: int = 1 << 20):
+    """从src流式复制恰好size字节到dst
+    
+    Args:
+        src: 源二进制流
+        dst: 目标二进制流，为None时丢弃数据
+        size: 字节数
+        chunk_size: 每次读取的字节数
+        
+    Raises:
+        EOFError: 源数据不足size字节时抛出
+    """
+    remaining = size
+    while remaining > 0:
+        chunk = src.read(min(chunk_size, remaining))
+        if not chunk:
+            raise EOFError(f"数据不完整，还差 {remaining} 字节")
+        if dst is not None:
+            dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def _extract_jsonlines(h: str) -> bool:
+    """从指定提交中导出三个jsonlines文件
+    
+    通过单个 ``git cat-file --batch`` 进程读取所需的blob并流式写入目标路径，
+    不检出整个工作区。提交中不存在的文件会被跳过。
+    
+    Args:
+        h: 提交哈希
+        
+    Returns:
+        bool: 是否至少导出了一个文件
+    """
     try:
-        subprocess.run(['git', '-C', str(_repo_dir()), 'checkout', '-f', h], check=True)
-        return True
-    except Exception:
+        proc = subprocess.Popen(['git', '-C', str(_REPO_DIR), 'cat-file', '--batch'],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+    except Exception as e:
+        logger.error(f"启动git cat-file失败: {e}")
         return False
+    
+    extracted = 0
+    p = None
+    try:
+        for key in ('character_file', 'person_file', 'subject_file'):
+            p = _FILE_PATHS[key]
+            rel_path = p.relative_to(_REPO_DIR).as_posix()
+            proc.stdin.write(f"{h}:{rel_path}\n".encode('utf-8'))
+            proc.stdin.flush()
+            
+            # 输出格式: "<oid> <type> <size>\n<内容>\n"，不存在时为 "<对象名> missing\n"
+            header = proc.stdout.readline().split()
+            if len(header) != 3:
+                logger.warning(f"提交 {h} 中不存在 {rel_path}")
+                continue
+            
+            size = int(header[2])
+            if header[1] != b'blob':
+                _copy_exact(proc.stdout, None, size)
+                proc.stdout.read(1)
+                logger.warning(f"提交 {h} 中 {rel_path} 不是文件")
+                continue
+            
+            with open(p, 'wb') as f:
+                _copy_exact(proc.stdout, f, size)
+            proc.stdout.read(1)
+            extracted += 1
+        p = None
+        
+    except Exception as e:
+        logger.error(f"提交 {h} 导出jsonlines失败: {e}")
+        # 输出流已错位，删除写了一半的文件并放弃本次导出
+        if p is not None:
+            try:
+                p.unlink()
+            except Exception:
+                pass
+        proc.kill()
+        return False
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    
+    return extracted > 0
+
+
+def _open_backup_session(types: List[str]) -> Optional[Tuple[Any, Dict[str, BaseDataProcessor]]]:
+    """建立迭代处理使用的长连接及各类型处理器
+    
+    连接、建表和临时暂存表在整个迭代过程中只建立一次，各提交之间复用。
+    
+    Args:
+        types: 数据类型列表
+        
+    Returns:
+        Optional[tuple]: (数据库连接, 数据类型 -> 处理器)，失败时返回None
+    """
+    import psycopg2
+    
+    try:
+        connection = psycopg2.connect(**DATABASE_CONFIG)
+        connection.autocommit = False
+    except Exception as e:
+        logger.error(f"数据库连接失败: {e}")
+        return None
+    
+    try:
+        processors: Dict[str, BaseDataProcessor] = {}
+        for t in types:
+            processor = ProcessorFactory.create_processor(t, DATABASE_CONFIG)
+            processor.use_connection(connection)
+            processor.create_tables()
+            # 整个迭代期间只删除一次二级索引，全部提交处理完成后由 _rebuild_session_indexes 重建
+            if processor.rebuild_indexes:
+                processor.drop_indexes()
+            processors[t] = processor
+        connection.commit()
+        return connection, processors
+    except Exception as e:
+        logger.error(f"初始化数据表失败: {e}")
+        connection.rollback()
+        connection.close()
+        return None
 
 
-def _backup_once(limit: Optional[int]) -> bool:
-    types = ['character', 'person', 'subject']
-    ok = 0
-    for t in types:
-        if process_data_type(t, limit):
-            ok += 1
-    return ok == len(types)
+def _rebuild_session_indexes(connection, processors: Dict[str, BaseDataProcessor]):
+    """迭代处理结束后一次性重建 _open_backup_session 删除的二级索引
+    
+    Args:
+        connection: 共享的数据库连接
+        processors: 数据类型 -> 处理器
+    """
+    targets = [p for p in processors.values() if p.rebuild_indexes]
+    if not targets:
+        return
+    if connection.closed:
+        logger.error("数据库连接已断开，二级索引未重建，请重新运行或手动创建")
+        return
+    
+    try:
+        connection.rollback()
+        for processor in targets:
+            processor.create_indexes_post_load()
+        connection.commit()
+    except Exception as e:
+        logger.error(f"重建二级索引失败: {e}")
+        connection.rollback()
+
+
+def _backup_once(connection, processors: Dict[str, BaseDataProcessor],
+                 data_date: str, limit: Optional[int]) -> bool:
+    """处理当前提交的全部数据类型
+    
+    三种数据共用一个数据库连接和一个事务：已导出的数据全部成功才提交，任一失败则整体回滚。
+    提交中不存在的数据文件会被跳过，不影响其他类型的数据入库。
+    
+    Args:
+        connection: 共享的数据库连接
+        processors: 数据类型 -> 处理器
+        data_date: 当前提交的数据日期
+        limit: 限制处理的记录数
+        
+    Returns:
+        bool: 是否全部处理成功（有类型被跳过时返回False）
+    """
+    present: Dict[str, BaseDataProcessor] = {}
+    for t, processor in processors.items():
+        if not _FILE_PATHS[f"{t}_file"].exists():
+            logger.warning(f"当前提交中没有 {t} 数据文件，跳过")
+            continue
+        processor.data_date = data_date
+        present[t] = processor
+    
+    if not present:
+        return False
+    
+    try:
+        ok = all(process_data_type(t, limit, p) for t, p in present.items())
+        if ok:
+            connection.commit()
+        else:
+            connection.rollback()
+        return ok and len(present) == len(processors)
+    except Exception as e:
+        logger.error(f"处理提交数据失败: {e}")
+        connection.rollback()
+        return False
 
 
 def main() -> int:
@@ -219,23 +469,35 @@ def main() -> int:
             if start_idx == -1:
                 logger.error(f"未找到起始日期对应的提交: {start_date}")
                 return 1
-            for h, d, _ in commits[start_idx:]:
-                _remove_jsonlines()
-                if not _checkout_commit(h):
-                    logger.error(f"切换提交失败: {h}")
-                    return 1
-                cfg.DATA_CONFIG['data_date'] = d
-                if not _backup_once(limit):
-                    logger.warning(f"提交 {h} 处理部分失败")
-                _remove_jsonlines()
+            types = ['character', 'person', 'subject']
+            session = _open_backup_session(types)
+            if session is None:
+                return 1
+            connection, processors = session
+            try:
+                for h, d, _ in commits[start_idx:]:
+                    # 连接意外断开时重新建立
+                    if connection.closed:
+                        session = _open_backup_session(types)
+                        if session is None:
+                            return 1
+                        connection, processors = session
+                    _remove_jsonlines()
+                    if not _extract_jsonlines(h):
+                        logger.error(f"导出提交数据失败: {h}")
+                        return 1
+                    cfg.DATA_CONFIG['data_date'] = d
+                    if not _backup_once(connection, processors, d, limit):
+                        logger.warning(f"提交 {h} 处理部分失败")
+                    _remove_jsonlines()
+            finally:
+                _rebuild_session_indexes(connection, processors)
+                connection.close()
             logger.info("迭代处理完成")
             return 0
         else:
-            success_count = 0
             total_count = len(data_types)
-            for data_type in data_types:
-                if process_data_type(data_type, limit):
-                    success_count += 1
+            success_count = process_data_types(data_types, limit)
             logger.info(f"\n=== 处理完成 ===")
             logger.info(f"成功处理: {success_count}/{total_count} 种数据类型")
             if success_count == total_count:
@@ -1,11 +1,14 @@
+import io
 import json
 import logging
 import os
+import queue
+import threading
 from abc import ABC, abstractmethod
+from functools import cached_property
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-
-from psycopg2.extras import execute_batch
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 try:
     from tqdm import tqdm
@@ -13,10 +16,35 @@ try:
 except ImportError:
     HAS_TQDM = False
 
-from config import BATCH_CONFIG
+from config import BATCH_CONFIG, DATA_CONFIG
+from utils import json_dumpb, json_loads
 
 logger = logging.getLogger(__name__)
 
+# COPY文本格式中需要转义的字符
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value: Any) -> bytes:
+    """将单个字段转换为COPY文本格式
+    
+    dict/list 作为JSONB直接序列化为bytes写入COPY数据，只序列化一次。
+    
+    Args:
+        value: 字段值
+        
+    Returns:
+        bytes: COPY文本格式的字段，None转换为 \\N
+    """
+    if value is None:
+        return b'\\N'
+    if isinstance(value, (dict, list)):
+        # JSON输出中的控制字符均已转义，只需转义反斜杠
+        return json_dumpb(value).replace(b'\\', b'\\\\')
+    if isinstance(value, str):
+        return value.translate(_COPY_ESCAPES).encode('utf-8')
+    return str(value).encode('utf-8')
+
 
 class BaseDataProcessor(ABC):
     """基础数据处理器抽象类
@@ -24,6 +52,9 @@ class BaseDataProcessor(ABC):
     提供公共的数据库连接、批处理和文件读取功能。
     """
     
+    # 目标表名（子类设置）
+    table_name: str = ''
+    
     def __init__(self, db_config: Dict[str, Any]):
         """初始化数据处理器
         
@@ -34,6 +65,13 @@ class BaseDataProcessor(ABC):
         self.connection = None
         self.batch_size = BATCH_CONFIG['batch_size']
         self.commit_interval = BATCH_CONFIG['commit_interval']
+        self.rebuild_indexes = BATCH_CONFIG['rebuild_indexes']
+        # 数据日期在创建处理器时确定，避免逐行查询全局配置
+        self.data_date = DATA_CONFIG['data_date']
+        # 为False时连接和事务由调用方管理，处理器不提交也不关闭连接
+        self.owns_connection = True
+        # 多进程并行处理时关闭进度条，避免多个进度条在同一终端互相覆盖
+        self.show_progress = True
         
     def connect_db(self) -> bool:
         """连接到PostgreSQL数据库
@@ -51,76 +89,159 @@ class BaseDataProcessor(ABC):
             logger.error(f"数据库连接失败: {e}")
             return False
     
+    def use_connection(self, connection):
+        """使用调用方提供的共享连接
+        
+        多个处理器共用一个连接和一个事务，由调用方统一提交或回滚；
+        任一批次写入失败时 process_file 抛出异常，由调用方回滚整个事务。
+        
+        Args:
+            connection: psycopg2连接
+        """
+        self.connection = connection
+        self.owns_connection = False
+    
+    def commit(self):
+        """提交事务（使用共享连接时由调用方提交）"""
+        if self.owns_connection:
+            self.connection.commit()
+    
+    def rollback(self):
+        """回滚事务（使用共享连接时由调用方回滚）"""
+        if self.owns_connection:
+            self.connection.rollback()
+    
     def close_connection(self):
         """关闭数据库连接"""
-        if self.connection:
+        if self.connection and self.owns_connection:
             self.connection.close()
             logger.info("数据库连接已关闭")
     
-    def count_lines(self, file_path: str) -> int:
-        """快速计算文件行数
-        
-        Args:
-            file_path: 文件路径
-            
-        Returns:
-            int: 文件行数
-        """
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return sum(1 for line in f if line.strip())
-        except Exception as e:
-            logger.warning(f"无法计算文件行数 {file_path}: {e}")
-            return 0
-    
     def read_jsonlines(self, file_path: str, limit: Optional[int] = None, 
-                      show_progress: bool = True) -> List[Dict[str, Any]]:
-        """读取jsonlines文件
+                      show_progress: bool = True) -> Iterator[Dict[str, Any]]:
+        """流式读取jsonlines文件
+        
+        逐行解析并产出记录，内存占用与文件大小无关。
         
         Args:
             file_path: 文件路径
             limit: 限制读取的行数，None表示读取全部
-            show_progress: 是否显示进度条
+            show_progress: 是否显示进度条（按已读取字节数）
             
-        Returns:
-            list: 解析后的JSON对象列表
+        Yields:
+            dict: 解析后的JSON对象
         """
-        data = []
-        total_lines = self.count_lines(file_path) if HAS_TQDM and show_progress else 0
+        count = 0
+        progress_bar = None
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                iterator = enumerate(f, 1)
-                if HAS_TQDM and show_progress and total_lines > 0:
-                    iterator = tqdm(iterator, total=total_lines, desc=f"读取 {Path(file_path).name}")
+            # 以二进制方式读取：进度按实际字节数计算，且JSON解析可直接接收bytes
+            with open(file_path, 'rb', buffering=1 << 20) as f:
+                if HAS_TQDM and show_progress:
+                    progress_bar = tqdm(total=os.path.getsize(file_path), unit='B',
+                                        unit_scale=True, desc=f"读取 {Path(file_path).name}")
                 
-                for line_num, line in iterator:
+                for line_num, line in enumerate(f, 1):
                     if limit and line_num > limit:
                         break
-                        
-                    line = line.strip()
-                    if line:
-                        try:
-                            data.append(json.loads(line))
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"第{line_num}行JSON解析失败: {e}")
-                            continue
-                        except Exception as e:
-                            logger.warning(f"第{line_num}行处理失败: {e}")
-                            continue
+                    
+                    if progress_bar is not None:
+                        progress_bar.update(len(line))
+                    
+                    # JSON解析允许首尾空白，无需strip产生新的bytes对象，只需跳过空行
+                    if line.isspace():
+                        continue
+                    
+                    try:
+                        item = json_loads(line)
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"第{line_num}行JSON解析失败: {e}")
+                        continue
+                    except Exception as e:
+                        logger.warning(f"第{line_num}行处理失败: {e}")
+                        continue
+                    
+                    count += 1
+                    yield item
                             
-            logger.info(f"成功读取 {file_path}，共 {len(data)} 条有效记录")
-            return data
+            logger.info(f"成功读取 {file_path}，共 {count} 条有效记录")
             
         except Exception as e:
             logger.error(f"读取文件 {file_path} 失败: {e}")
-            return []
+        finally:
+            if progress_bar is not None:
+                progress_bar.close()
+    
+    @property
+    def staging_table_name(self) -> str:
+        """COPY使用的暂存表名"""
+        return f"staging_{self.table_name}"
+    
+    def create_staging_table(self, cursor):
+        """创建会话级临时暂存表
+        
+        暂存表结构与目标表一致但不含主键和索引，不写WAL，且每个连接独享，用于COPY批量导入。
+        
+        Args:
+            cursor: 数据库游标
+        """
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {self.staging_table_name}
+            (LIKE {self.table_name} INCLUDING DEFAULTS)
+        """)
     
     @abstractmethod
-    def create_tables(self):
-        """创建数据库表（子类实现）"""
+    def create_tables_pre_load(self):
+        """创建数据表、主键和暂存表，不含二级索引（子类实现）"""
+        pass
+    
+    @abstractmethod
+    def get_index_definitions(self) -> Dict[str, str]:
+        """获取二级索引定义（子类实现）
+        
+        Returns:
+            dict: 索引名 -> ``ON`` 之后的索引定义，如 ``subject_stats(score DESC)``
+        """
         pass
     
+    def create_indexes_post_load(self):
+        """创建二级索引"""
+        try:
+            with self.connection.cursor() as cursor:
+                for index_name, definition in self.get_index_definitions().items():
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {definition}")
+            self.commit()
+            logger.info(f"{self.table_name}索引创建成功")
+            
+        except Exception as e:
+            logger.error(f"创建{self.table_name}索引失败: {e}")
+            self.rollback()
+            raise
+    
+    def drop_indexes(self):
+        """删除二级索引，避免批量导入时逐行维护索引"""
+        try:
+            with self.connection.cursor() as cursor:
+                for index_name in self.get_index_definitions():
+                    cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+            self.commit()
+            logger.info(f"{self.table_name}索引已删除，导入完成后重建")
+            
+        except Exception as e:
+            logger.error(f"删除{self.table_name}索引失败: {e}")
+            self.rollback()
+            raise
+    
+    def create_tables(self):
+        """创建数据库表
+        
+        开启 ``rebuild_indexes`` 时不创建二级索引，由调用方在全部导入完成后调用
+        create_indexes_post_load 创建。
+        """
+        self.create_tables_pre_load()
+        if not self.rebuild_indexes:
+            self.create_indexes_post_load()
+    
     @abstractmethod
     def validate_data(self, item: Dict[str, Any]) -> bool:
         """验证数据有效性（子类实现）
@@ -149,6 +270,8 @@ class BaseDataProcessor(ABC):
     def get_upsert_sql(self) -> str:
         """获取UPSERT SQL语句（子类实现）
         
+        语句从暂存表 ``INSERT ... SELECT`` 合并到目标表，暂存表中的id已在prepare_batch中去重。
+        
         Returns:
             str: SQL语句
         """
@@ -156,57 +279,143 @@ class BaseDataProcessor(ABC):
     
 
     
-    def process_batch(self, batch_data: List[Dict[str, Any]]) -> tuple:
-        """批量处理数据
+    @cached_property
+    def upsert_sql(self) -> str:
+        """缓存的UPSERT SQL语句
+        
+        表名在实例生命周期内不变，SQL只需生成一次。
+        
+        Returns:
+            str: SQL语句
+        """
+        return self.get_upsert_sql()
+    
+    def prepare_batch(self, batch_data: List[Dict[str, Any]]) -> Tuple[io.BytesIO, int, int]:
+        """验证并提取批量数据，生成COPY数据
+        
+        只做CPU计算，不访问数据库，可与数据库写入并行执行。
         
         Args:
             batch_data: 批量数据
             
         Returns:
-            tuple: (成功数量, 失败数量)
+            tuple: (COPY数据缓冲区, 有效数量, 失败数量)
         """
-        try:
-            with self.connection.cursor() as cursor:
-                insert_data = []
-                error_count = 0
-                
-                for item in batch_data:
-                    try:
-                        if not self.validate_data(item):
-                            logger.warning(f"跳过无效数据: {item.get('id', 'unknown')}")
-                            error_count += 1
-                            continue
-                        
-                        extracted_fields = self.extract_fields(item)
-                        insert_data.append(extracted_fields)
-                        
-                    except Exception as e:
-                        logger.error(f"处理记录失败 {item.get('id', 'unknown')}: {e}")
-                        error_count += 1
-                        continue
-                
-                # 批量执行UPSERT
-                if insert_data:
-                    execute_batch(cursor, self.get_upsert_sql(), insert_data, 
-                                page_size=self.batch_size)
-                    
-                self.connection.commit()
-                success_count = len(insert_data)
-                logger.info(f"成功处理批次，插入/更新 {success_count} 条记录，失败 {error_count} 条记录")
+        # 每条记录直接编码为COPY行。同一条INSERT内主键不能重复（ON CONFLICT无法二次更新同一行），
+        # 按id去重并保留最后一条，与逐行UPSERT的结果一致
+        rows: Dict[Any, bytes] = {}
+        error_count = 0
+        
+        # 循环内频繁调用的方法预先绑定为局部变量
+        validate = self.validate_data
+        extract = self.extract_fields
+        join = b'\t'.join
+        
+        for item in batch_data:
+            try:
+                if not validate(item):
+                    logger.warning(f"跳过无效数据: {item.get('id', 'unknown')}")
+                    error_count += 1
+                    continue
                 
-                return success_count, error_count
+                fields = extract(item)
+                rows[fields[0]] = join(map(_copy_value, fields))
                 
+            except Exception as e:
+                logger.error(f"处理记录失败 {item.get('id', 'unknown')}: {e}")
+                error_count += 1
+                continue
+        
+        buffer = io.BytesIO()
+        if rows:
+            buffer.write(b'\n'.join(rows.values()))
+            buffer.write(b'\n')
+        buffer.seek(0)
+        success_count = len(rows)
+        
+        return buffer, success_count, error_count
+    
+    def write_batch(self, buffer: io.BytesIO):
+        """将COPY数据写入数据库并提交
+        
+        COPY到暂存表后合并到目标表。使用共享连接时不提交也不回滚，由调用方处理。
+        
+        Args:
+            buffer: prepare_batch生成的COPY数据
+        """
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {self.staging_table_name}")
+                cursor.copy_expert(f"COPY {self.staging_table_name} FROM STDIN", buffer)
+                cursor.execute(self.upsert_sql)
+            self.commit()
+            
         except Exception as e:
             logger.error(f"批量处理失败: {e}")
-            self.connection.rollback()
+            self.rollback()
             raise
     
+    def process_batch(self, batch_data: List[Dict[str, Any]]) -> tuple:
+        """批量处理数据
+        
+        Args:
+            batch_data: 批量数据
+            
+        Returns:
+            tuple: (成功数量, 失败数量)
+        """
+        buffer, success_count, error_count = self.prepare_batch(batch_data)
+        if success_count:
+            self.write_batch(buffer)
+        logger.info(f"成功处理批次，插入/更新 {success_count} 条记录，失败 {error_count} 条记录")
+        
+        return success_count, error_count
+    
+    def _db_writer(self, tasks: queue.Queue, stats: Dict[str, Any]):
+        """数据库写入线程
+        
+        从队列中取出已准备好的批次依次写入，收到None时退出。
+        使用共享连接时，首个失败批次会使事务中止，记录到 ``stats['failure']`` 后不再写入后续批次。
+        
+        Args:
+            tasks: 批次队列，元素为 (批次号, COPY数据, 有效数量, 失败数量)
+            stats: 成功/失败计数及共享连接下的失败异常，由本线程独占更新
+        """
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            
+            batch_num, buffer, success_count, error_count = task
+            if stats['failure'] is not None:
+                stats['error'] += success_count + error_count
+                continue
+            
+            try:
+                if success_count:
+                    self.write_batch(buffer)
+                stats['success'] += success_count
+                stats['error'] += error_count
+                logger.info(f"成功处理批次，插入/更新 {success_count} 条记录，失败 {error_count} 条记录")
+                
+            except Exception as e:
+                logger.error(f"处理批次 {batch_num} 失败: {e}")
+                stats['error'] += success_count + error_count
+                if not self.owns_connection:
+                    stats['failure'] = e
+    
     def process_file(self, file_path: str, limit: Optional[int] = None):
         """处理文件的通用方法
         
+        主线程负责读取、解析和准备批次，后台线程负责写入数据库，
+        使解析与数据库提交（等待fsync）重叠进行。
+        
         Args:
             file_path: 文件路径
             limit: 限制处理的记录数
+            
+        Raises:
+            RuntimeError: 使用共享连接且有批次写入失败时抛出
         """
         logger.info(f"开始处理文件: {file_path}")
         
@@ -214,40 +423,45 @@ class BaseDataProcessor(ABC):
             logger.error(f"文件不存在: {file_path}")
             return
         
-        # 读取数据
-        data = self.read_jsonlines(file_path, limit)
-        if not data:
-            logger.warning("没有读取到有效数据")
-            return
-        
-        # 分批处理
-        total_batches = (len(data) + self.batch_size - 1) // self.batch_size
+        # 流式读取，每次只保留少量批次在内存中
+        records = self.read_jsonlines(file_path, limit, show_progress=self.show_progress)
         
-        if HAS_TQDM:
-            progress_bar = tqdm(total=len(data), desc="处理进度")
+        stats: Dict[str, Any] = {'success': 0, 'error': 0, 'failure': None}
+        tasks: queue.Queue = queue.Queue(maxsize=2)
+        writer = threading.Thread(target=self._db_writer, args=(tasks, stats),
+                                  name=f"{self.table_name}-writer", daemon=True)
+        writer.start()
         
-        total_success = 0
-        total_error = 0
+        prepare_errors = 0
+        batch_num = 0
         
-        for i in range(0, len(data), self.batch_size):
-            batch = data[i:i + self.batch_size]
-            
-            try:
-                success_count, error_count = self.process_batch(batch)
-                total_success += success_count
-                total_error += error_count
+        try:
+            batch_size = self.batch_size
+            while batch := list(islice(records, batch_size)):
+                # 共享连接的事务已中止，继续读取没有意义
+                if stats['failure'] is not None:
+                    break
+                batch_num += 1
                 
-                if HAS_TQDM:
-                    progress_bar.update(len(batch))
-                    
-            except Exception as e:
-                logger.error(f"处理批次 {i//self.batch_size + 1}/{total_batches} 失败: {e}")
-                total_error += len(batch)
+                try:
+                    buffer, success_count, error_count = self.prepare_batch(batch)
+                except Exception as e:
+                    logger.error(f"处理批次 {batch_num} 失败: {e}")
+                    prepare_errors += len(batch)
+                    continue
                 
-                if HAS_TQDM:
-                    progress_bar.update(len(batch))
+                tasks.put((batch_num, buffer, success_count, error_count))
+        finally:
+            tasks.put(None)
+            writer.join()
+        
+        if stats['failure'] is not None:
+            raise RuntimeError(f"写入 {self.table_name} 失败，事务需回滚: {stats['failure']}") from stats['failure']
         
-        if HAS_TQDM:
-            progress_bar.close()
+        if batch_num == 0:
+            logger.warning("没有读取到有效数据")
+            return
         
+        total_success = stats['success']
+        total_error = stats['error'] + prepare_errors
         logger.info(f"文件处理完成: 成功 {total_success} 条，失败 {total_error} 条")
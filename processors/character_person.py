@@ -2,7 +2,6 @@ import logging
 from typing import Any, Dict
 
 from .base import BaseDataProcessor
-from config import DATA_CONFIG
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +23,7 @@ class CharacterPersonProcessor(BaseDataProcessor):
         self.data_type = data_type
         self.table_name = f"{data_type}_stats"
     
-    def create_tables(self):
+    def create_tables_pre_load(self):
         """创建character和person表"""
         try:
             with self.connection.cursor() as cursor:
@@ -39,25 +38,28 @@ class CharacterPersonProcessor(BaseDataProcessor):
                     )
                 """)
                 
-                # 创建索引
-                cursor.execute(f"""
-                    CREATE INDEX IF NOT EXISTS idx_{self.table_name}_comments 
-                    ON {self.table_name}(comments DESC)
-                """)
-                
-                cursor.execute(f"""
-                    CREATE INDEX IF NOT EXISTS idx_{self.table_name}_collects 
-                    ON {self.table_name}(collects DESC)
-                """)
+                # 创建COPY暂存表
+                self.create_staging_table(cursor)
                 
-                self.connection.commit()  # type: ignore
+                self.commit()
                 logger.info(f"{self.data_type}表创建成功")
                 
         except Exception as e:
             logger.error(f"创建{self.data_type}表失败: {e}")
-            self.connection.rollback()  # type: ignore
+            self.rollback()
             raise
     
+    def get_index_definitions(self) -> Dict[str, str]:
+        """获取character/person的二级索引定义
+        
+        Returns:
+            dict: 索引名 -> 索引定义
+        """
+        return {
+            f"idx_{self.table_name}_comments": f"{self.table_name}(comments DESC)",
+            f"idx_{self.table_name}_collects": f"{self.table_name}(collects DESC)",
+        }
+    
     def validate_data(self, item: Dict[str, Any]) -> bool:
         """验证character/person数据
         
@@ -78,11 +80,14 @@ class CharacterPersonProcessor(BaseDataProcessor):
         Returns:
             tuple: 提取的字段元组
         """
+        # JSON中的计数通常已是int，跳过int()转换；None或缺失时为0
+        comments = item.get('comments')
+        collects = item.get('collects')
         return (
             item['id'],
-            int(item.get('comments') or 0),
-            int(item.get('collects') or 0),
-            DATA_CONFIG['data_date']
+            comments if type(comments) is int else int(comments or 0),
+            collects if type(collects) is int else int(collects or 0),
+            self.data_date
         )
     
     def get_upsert_sql(self) -> str:
@@ -93,7 +98,7 @@ class CharacterPersonProcessor(BaseDataProcessor):
         """
         return f"""
             INSERT INTO {self.table_name} (id, comments, collects, data_date)
-            VALUES (%s, %s, %s, %s)
+            SELECT id, comments, collects, data_date FROM {self.staging_table_name}
             ON CONFLICT (id, data_date) DO UPDATE SET
                 comments = EXCLUDED.comments,
                 collects = EXCLUDED.collects
@@ -1,12 +1,16 @@
-import json
 import logging
 from typing import Any, Dict
 
 from .base import BaseDataProcessor
-from config import DATA_CONFIG
 
 logger = logging.getLogger(__name__)
 
+# score_details 的合法评分键 '1'~'10'
+_VALID_SCORE_KEYS = frozenset(str(i) for i in range(1, 11))
+
+# favorite 的标准字段
+_EXPECTED_FAVORITE_KEYS = frozenset({'wish', 'done', 'doing', 'on_hold', 'dropped'})
+
 
 class SubjectProcessor(BaseDataProcessor):
     """Subject数据处理器
@@ -14,7 +18,9 @@ class SubjectProcessor(BaseDataProcessor):
     用于处理作品数据的提取、验证和数据库操作。
     """
     
-    def create_tables(self):
+    table_name = 'subject_stats'
+    
+    def create_tables_pre_load(self):
         """创建subject表"""
         try:
             with self.connection.cursor() as cursor:
@@ -31,35 +37,30 @@ class SubjectProcessor(BaseDataProcessor):
                     )
                 """)
                 
-                # 创建索引
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_subject_stats_score 
-                    ON subject_stats(score DESC)
-                """)
-                
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_subject_stats_rank 
-                    ON subject_stats(rank ASC)
-                """)
-                
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_subject_stats_score_details 
-                    ON subject_stats USING GIN(score_details)
-                """)
-                
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_subject_stats_favorite 
-                    ON subject_stats USING GIN(favorite)
-                """)
+                # 创建COPY暂存表
+                self.create_staging_table(cursor)
                 
-                self.connection.commit()  # type: ignore
+                self.commit()
                 logger.info("Subject表创建成功")
                 
         except Exception as e:
             logger.error(f"创建Subject表失败: {e}")
-            self.connection.rollback()  # type: ignore
+            self.rollback()
             raise
     
+    def get_index_definitions(self) -> Dict[str, str]:
+        """获取subject的二级索引定义
+        
+        Returns:
+            dict: 索引名 -> 索引定义
+        """
+        return {
+            'idx_subject_stats_score': 'subject_stats(score DESC)',
+            'idx_subject_stats_rank': 'subject_stats(rank ASC)',
+            'idx_subject_stats_score_details': 'subject_stats USING GIN(score_details)',
+            'idx_subject_stats_favorite': 'subject_stats USING GIN(favorite)',
+        }
+    
     def validate_data(self, item: Dict[str, Any]) -> bool:
         """验证subject数据
         
@@ -78,10 +79,9 @@ class SubjectProcessor(BaseDataProcessor):
         if score_details is not None:
             if not isinstance(score_details, dict):
                 return False
-            # 检查是否包含1-10的评分键
-            for key in score_details.keys():
-                if not (key.isdigit() and 1 <= int(key) <= 10):
-                    logger.warning(f"无效的score_details键: {key}")
+            # 检查是否包含1-10的评分键（dict键视图可直接与集合比较，无需构造新集合）
+            if not score_details.keys() <= _VALID_SCORE_KEYS:
+                logger.warning(f"无效的score_details键: {score_details.keys() - _VALID_SCORE_KEYS}")
                     
         # 验证favorite格式
         favorite = item.get('favorite')
@@ -89,9 +89,8 @@ class SubjectProcessor(BaseDataProcessor):
             if not isinstance(favorite, dict):
                 return False
             # 检查favorite的标准字段
-            expected_keys = {'wish', 'done', 'doing', 'on_hold', 'dropped'}
-            if not set(favorite.keys()).issubset(expected_keys):
-                logger.warning(f"favorite包含未知字段: {set(favorite.keys()) - expected_keys}")
+            if not favorite.keys() <= _EXPECTED_FAVORITE_KEYS:
+                logger.warning(f"favorite包含未知字段: {favorite.keys() - _EXPECTED_FAVORITE_KEYS}")
                 
         return True
     
@@ -104,20 +103,10 @@ class SubjectProcessor(BaseDataProcessor):
         Returns:
             tuple: 提取的字段元组
         """
-        # 提取字段
-        item_id = item.get('id')
-        score = item.get('score')
-        score_details = item.get('score_details')
-        rank = item.get('rank')
-        favorite = item.get('favorite')
-        
-        # 转换为JSON字符串
-        score_details_json = json.dumps(score_details) if score_details is not None else None
-        favorite_json = json.dumps(favorite) if favorite is not None else None
-        
+        # score_details/favorite 保持为dict，在生成COPY数据时直接序列化为JSONB
         return (
-            item_id, score, score_details_json, 
-            rank, favorite_json, DATA_CONFIG['data_date']
+            item.get('id'), item.get('score'), item.get('score_details'),
+            item.get('rank'), item.get('favorite'), self.data_date
         )
     
     def get_upsert_sql(self) -> str:
@@ -126,9 +115,9 @@ class SubjectProcessor(BaseDataProcessor):
         Returns:
             str: UPSERT SQL语句
         """
-        return """
+        return f"""
             INSERT INTO subject_stats (id, score, score_details, rank, favorite, data_date)
-            VALUES (%s, %s, %s, %s, %s, %s)
+            SELECT id, score, score_details, rank, favorite, data_date FROM {self.staging_table_name}
             ON CONFLICT (id, data_date) DO UPDATE SET
                 score = EXCLUDED.score,
                 score_details = EXCLUDED.score_details,
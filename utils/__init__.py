@@ -3,8 +3,11 @@
 提供文件处理、日志配置等工具函数。
 """
 
+from .json_utils import json_dumpb, json_loads
 from .logger import setup_logger
 
 __all__ = [
-    'setup_logger'
+    'setup_logger',
+    'json_loads',
+    'json_dumpb'
 ]
@@ -0,0 +1,46 @@
+"""JSON编解码工具模块
+
+优先使用orjson（C实现，解析和序列化均明显快于标准库），未安装时回退到标准库json。
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """解析JSON
+    
+    Args:
+        data: JSON文本，str或bytes
+        
+    Returns:
+        Any: 解析后的对象
+        
+    Raises:
+        json.JSONDecodeError: JSON格式错误时抛出（orjson的异常是其子类）
+    """
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumpb(obj: Any) -> bytes:
+    """序列化为UTF-8编码的JSON bytes
+    
+    orjson直接输出bytes，省去str编码/解码的往返。
+    
+    Args:
+        obj: 待序列化对象
+        
+    Returns:
+        bytes: JSON bytes
+    """
+    if HAS_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')